@@ -1,37 +1,49 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
-from sqlalchemy import create_engine, text
-import time
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+import connectorx as cx
+from concurrent.futures import ThreadPoolExecutor
 import os
 
 
-# --- SIDEBAR CONFIGURATION ---
-st.sidebar.title("⚙️ Settings")
-selected_symbol = st.sidebar.selectbox(
-    "Select Asset",
-    ["BTCUSDT", "ETHUSDT", "SOLUSDT", "XRPUSDT"],
-    index=0
-)
-
-
 # --- CONFIGURATION ---
+# Must be the first Streamlit call of every run. It is per-session page
+# state, so it cannot be hidden behind st.cache_resource.
 st.set_page_config(
     page_title="Alpha-Pulse Terminal", 
     layout="wide",
     initial_sidebar_state="expanded"   # <--- TO THIS
 )
 
+SYMBOLS = ("BTCUSDT", "ETHUSDT", "SOLUSDT", "XRPUSDT")
+
+# --- SIDEBAR CONFIGURATION ---
+st.sidebar.title("⚙️ Settings")
+selected_symbol = st.sidebar.selectbox(
+    "Select Asset",
+    SYMBOLS,
+    index=0
+)
+
 
 # Defaults to 'localhost' if not running in Docker
 db_host = os.getenv("DB_HOST", "localhost")
 DB_URL = f"postgresql://user:password@{db_host}:5432/alpha_db"
 
-@st.cache_resource
-def get_engine():
-    return create_engine(DB_URL)
+# Queries are written with SQLAlchemy binds but executed by connectorx,
+# which decodes Postgres' binary protocol straight into columnar buffers
+# instead of building a Python tuple per row.
+PG_DIALECT = postgresql.dialect()
 
-engine = get_engine()
+def read_frame(query, params):
+    """Bind params into a text() query and fetch it as a DataFrame via connectorx."""
+    sql = query.bindparams(**params).compile(
+        dialect=PG_DIALECT, compile_kwargs={"literal_binds": True}
+    )
+    return cx.read_sql(DB_URL, str(sql))
 
 # --- TIME FILTERS ---
 TIME_RANGES = {
@@ -43,6 +55,9 @@ TIME_RANGES = {
     "ALL": "ALL"
 }
 
+# Candles are 1-minute buckets, so reruns inside the TTL reuse the cached
+# frames instead of hitting Postgres on every refresh.
+@st.cache_data(ttl=30, show_spinner=False)
 def load_data(interval_code, symbol):
     """Fetch clean OHLC data and a continuous forecast history."""
     
@@ -52,18 +67,22 @@ def load_data(interval_code, symbol):
     market_where = "WHERE symbol = :symbol"
     forecast_where = "WHERE symbol = :symbol"
     limit_clause = ""
+    params = {"symbol": symbol}
 
     # 2. Add Time Filter (if not ALL)
+    # The window is a bound parameter, so every range shares the same
+    # statement text instead of splicing the interval into the SQL.
     if interval_code == "ALL":
         limit_clause = "LIMIT 50000"
     else:
         # Since we already have "WHERE ...", we append with "AND"
-        market_where += f" AND bucket_time >= NOW() - INTERVAL '{interval_code}'"
-        forecast_where += f" AND forecast_time >= NOW() - INTERVAL '{interval_code}'"
+        market_where += " AND bucket_time >= NOW() - CAST(:window AS INTERVAL)"
+        forecast_where += " AND forecast_time >= NOW() - CAST(:window AS INTERVAL)"
+        params["window"] = interval_code
 
     # 3. Fetch Market Data
     query_market = text(f"""
-        SELECT bucket_time, open, high, low, close, sentiment_score, volume
+        SELECT bucket_time, open, high, low, close
         FROM market_candles
         {market_where}
         ORDER BY bucket_time ASC
@@ -80,145 +99,326 @@ def load_data(interval_code, symbol):
         {limit_clause}
     """)
     
-    with engine.connect() as conn:
-        # Pass {"symbol": symbol} to both calls
-        df_market = pd.read_sql(query_market, conn, params={"symbol": symbol})
-        df_forecast = pd.read_sql(query_forecast, conn, params={"symbol": symbol})
-        
-        # Force Datetime objects to be UTC-aware/clean
-        if not df_market.empty:
-            df_market['bucket_time'] = pd.to_datetime(df_market['bucket_time'])
-        if not df_forecast.empty:
-            df_forecast['forecast_time'] = pd.to_datetime(df_forecast['forecast_time'])
+    # Pass the same params to both calls. The queries are independent and
+    # connectorx opens its own connection per call, so run them side by side:
+    # the wait becomes the slower of the two instead of their sum.
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        market_job = pool.submit(read_frame, query_market, params)
+        forecast_job = pool.submit(read_frame, query_forecast, params)
+        df_market, df_forecast = market_job.result(), forecast_job.result()
+
+    # Force Datetime objects to be clean datetime64[ns], so hot paths can
+    # compare their raw int64 view instead of Timestamp objects
+    if not df_market.empty:
+        df_market['bucket_time'] = pd.to_datetime(df_market['bucket_time']).astype('datetime64[ns]')
+    if not df_forecast.empty:
+        df_forecast['forecast_time'] = pd.to_datetime(df_forecast['forecast_time']).astype('datetime64[ns]')
 
     return df_market, df_forecast
 
+@st.cache_data(ttl=5, show_spinner=False)
+def load_tail(symbol):
+    """
+    Fetch the 10 newest candles (newest first) for the KPI row and the table.
+    Volume and sentiment are only needed here, so the big chart query skips them.
+    """
+    query_tail = text("""
+        SELECT bucket_time, open, close, volume, sentiment_score
+        FROM market_candles
+        WHERE symbol = :symbol
+        ORDER BY bucket_time DESC
+        LIMIT 10
+    """)
+    df_tail = read_frame(query_tail, {"symbol": symbol})
+    df_tail['bucket_time'] = df_tail['bucket_time'].astype('datetime64[ns]')
+    return df_tail
+
+# --- DOWNSAMPLING ---
+# A full-width chart cannot show more points than it has pixels, so long
+# series are reduced before being shipped to the browser: lines with LTTB,
+# candles by merging neighbours into OHLC bars.
+CHART_MAX_POINTS = 2000
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: pick the n_out points that best preserve
+    the visual shape of (x, y). Always keeps the first and last point.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # Points 1..n-2 are split into n_out-2 buckets; one point is kept per bucket
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # The third triangle vertex is the average of the NEXT bucket
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], edges[i + 2]
+        else:
+            nlo, nhi = n - 1, n
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(area.argmax())
+        idx[i + 1] = a
+
+    return idx
+
+def downsample(df, x_col, y_col, n_out=CHART_MAX_POINTS):
+    """Row-slice df down to n_out LTTB points, keeping all columns aligned."""
+    if len(df) <= n_out:
+        return df
+    x = df[x_col].values.view('i8')
+    return df.iloc[lttb_indices(x, df[y_col].values, n_out)]
+
+def bucket_ohlc(df, n_out=CHART_MAX_POINTS):
+    """
+    Merge consecutive candles into at most n_out bars (first open, max high,
+    min low, last close), so no price extreme is dropped the way a row
+    sample would drop it. Each bar is stamped with its first candle's time.
+    """
+    n = len(df)
+    if n <= n_out:
+        return df
+    starts = np.unique(np.linspace(0, n, n_out, endpoint=False).astype(np.int64))
+    ends = np.append(starts[1:], n) - 1
+    return pd.DataFrame({
+        'bucket_time': df['bucket_time'].values[starts],
+        'open': df['open'].values[starts],
+        'high': np.maximum.reduceat(df['high'].to_numpy(dtype=float), starts),
+        'low': np.minimum.reduceat(df['low'].to_numpy(dtype=float), starts),
+        'close': df['close'].values[ends],
+    })
+
+# --- CANDLE RENDERERS ---
+# SVG candlesticks create DOM shapes per candle and bog down the browser on
+# long ranges, so above this size we switch to WebGL OHLC bars.
+WEBGL_CANDLE_THRESHOLD = 5000
+OHLC_TICK_WIDTH = np.timedelta64(20, 's')
+
+def render_candles_svg(df):
+    """Trace data for classic SVG candlesticks (short ranges)."""
+    return [dict(
+        x=df['bucket_time'].values,
+        open=df['open'].values, high=df['high'].values,
+        low=df['low'].values, close=df['close'].values
+    )]
+
+def render_candles_gl(df):
+    """
+    Trace data for WebGL OHLC bars (long ranges).
+    Each candle is drawn as a high-low stem plus open/close ticks, using NaN
+    gaps to break the line between segments (one trace per direction).
+    """
+    t = df['bucket_time'].values
+    o, h, l, c = (df[col].to_numpy(dtype=float) for col in ('open', 'high', 'low', 'close'))
+    gap = np.full(len(df), np.nan)
+    rising = c >= o
+
+    traces = []
+    for mask in (rising, ~rising):
+        tm = t[mask]
+        x = np.stack([tm, tm, tm, tm - OHLC_TICK_WIDTH, tm, tm, tm, tm + OHLC_TICK_WIDTH, tm], axis=1).ravel()
+        y = np.stack([l[mask], h[mask], gap[mask], o[mask], o[mask], gap[mask], c[mask], c[mask], gap[mask]], axis=1).ravel()
+        traces.append(dict(x=x, y=y))
+    return traces
+
+# --- CHART ---
+# The figure is split into a skeleton (styled, empty traces + layout), built
+# once per view, and the trace data, which is all that changes on a refresh.
+def new_figure(revision, webgl):
+    """Chart skeleton: confidence band, candles and forecast line, no data."""
+    fig = go.Figure()
+
+    # A. Confidence Band
+    fig.add_trace(go.Scatter(
+        mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'
+    ))
+    fig.add_trace(go.Scatter(
+        mode='lines', line=dict(width=0), fill='tonexty',
+        fillcolor='rgba(0, 200, 255, 0.1)', name='Confidence (95%)', hoverinfo='skip'
+    ))
+
+    # B. Actual Price
+    # Either way, candles are OHLC-bucketed to pixel width before plotting
+    if webgl:
+        for color, show in (('#26a69a', True), ('#ef5350', False)):
+            fig.add_trace(go.Scattergl(
+                mode='lines', name='BTC Actual',
+                legendgroup='actual', showlegend=show,
+                line=dict(color=color, width=1)
+            ))
+    else:
+        fig.add_trace(go.Candlestick(
+            name='BTC Actual',
+            increasing_line_color='#26a69a', decreasing_line_color='#ef5350'
+        ))
+
+    # C. AI Forecast
+    fig.add_trace(go.Scatter(
+        mode='lines', name='AI Forecast',
+        line=dict(color='#C0C0F0', width=2)
+    ))
+
+    fig.update_layout(
+        template="plotly_dark", height=600,
+        xaxis_rangeslider_visible=False, hovermode="x unified",
+        margin=dict(l=10, r=10, t=10, b=10),
+        legend=dict(orientation="h", y=1.02, x=0, bgcolor="rgba(0,0,0,0)"),
+        xaxis=dict(type='date'),
+        uirevision=revision
+    )
+
+    return fig
+
+def update_figure(fig, df_market, df_forecast, webgl):
+    """Swap fresh data into the skeleton's traces (same order as new_figure)."""
+    chart_forecast = downsample(df_forecast, 'forecast_time', 'predicted_price')
+    forecast_x = chart_forecast['forecast_time'].values
+
+    # Candles are merged, never row-sampled, so every wick survives
+    chart_market = bucket_ohlc(df_market)
+    if webgl:
+        candles = render_candles_gl(chart_market)
+    else:
+        candles = render_candles_svg(chart_market)
+
+    trace_data = [
+        dict(x=forecast_x, y=chart_forecast['lower_bound'].values),
+        dict(x=forecast_x, y=chart_forecast['upper_bound'].values),
+        *candles,
+        dict(x=forecast_x, y=chart_forecast['predicted_price'].values),
+    ]
+    with fig.batch_update():
+        for trace, data in zip(fig.data, trace_data):
+            trace.update(data)
+
 # --- MAIN APP ---
 st.title("⚡ Alpha-Pulse: Quant Trading Dashboard")
 
 # 1. Filter Widget
 selected_range = st.radio(
     "Range:", 
-    options=["15M", "30M", "1H", "1D", "1W", "ALL"], 
+    options=list(TIME_RANGES), 
     index=2, # Default to 1H to see context
     horizontal=True,
     key="time_selector"
 )
 
-# 2. Data Loading
-interval_val = TIME_RANGES[selected_range]
-df_market, df_forecast = load_data(interval_val, selected_symbol) # Pass selected_symbol
-
-if df_market.empty:
-    st.warning(f"⏳ Waiting for data pipeline... (View: {selected_range})")
-    time.sleep(2)
-    st.rerun()
-
-# 3. Metrics Calculation
-latest_close = df_market['close'].iloc[-1]
-latest_open = df_market['open'].iloc[-1]
-diff = latest_close - latest_open
-pct = (diff / latest_open) * 100
-sentiment = df_market['sentiment_score'].iloc[-1]
-
-# 4. Visual Stitching (Connecting the Lines)
-# We connect the green line (Actuals) to the yellow line (Forecast)
-# only if there is a gap between them.
-if not df_market.empty and not df_forecast.empty:
-    last_actual_time = df_market['bucket_time'].iloc[-1]
-    last_actual_price = df_market['close'].iloc[-1]
-    
-    # Check if the forecast starts AFTER the actuals end
-    if df_forecast['forecast_time'].iloc[0] > last_actual_time:
-        bridge_row = pd.DataFrame({
-            'forecast_time': [last_actual_time], 
-            'predicted_price': [last_actual_price],
-            'lower_bound': [last_actual_price],
-            'upper_bound': [last_actual_price]
-        })
-        df_forecast = pd.concat([bridge_row, df_forecast], ignore_index=True).sort_values('forecast_time')
-
-# 5. Render Metrics
-kpi1, kpi2, kpi3, kpi4 = st.columns(4)
-
-kpi1.metric(f"{selected_symbol} Price", f"${latest_close:,.2f}", f"{diff:+.2f} ({pct:+.2f}%)")
-
-sent_label = "Neutral"
-if sentiment > 0.05: sent_label = "Bullish"
-elif sentiment < -0.05: sent_label = "Bearish"
-
-kpi2.metric("Sentiment", f"{sentiment:.4f}", sent_label)
-
-kpi3.metric("Forecast Model", "Prophet (60m)", "Active 🟢")
-
-# Anomaly Logic
-is_anomaly = False
-if not df_forecast.empty:
-    # Check against the prediction for the CURRENT time
-    current_pred = df_forecast[df_forecast['forecast_time'] == df_market['bucket_time'].iloc[-1]]
-    if not current_pred.empty:
-        lower = current_pred['lower_bound'].iloc[0]
-        upper = current_pred['upper_bound'].iloc[0]
-        if latest_close < lower or latest_close > upper:
-            is_anomaly = True
-
-if is_anomaly:
-    kpi4.error("⚠️ ANOMALY DETECTED")
-else:
-    kpi4.success("✅ Market Normal")
-
-# --- CHARTING ---
-st.subheader("Market Analysis & AI Projection")
-
-fig = go.Figure()
-
-# A. Confidence Band
-fig.add_trace(go.Scatter(
-    x=df_forecast['forecast_time'], y=df_forecast['lower_bound'],
-    mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'
-))
-fig.add_trace(go.Scatter(
-    x=df_forecast['forecast_time'], y=df_forecast['upper_bound'],
-    mode='lines', line=dict(width=0), fill='tonexty',
-    fillcolor='rgba(0, 200, 255, 0.1)', name='Confidence (95%)', hoverinfo='skip'
-))
-
-# B. Actual Price
-fig.add_trace(go.Candlestick(
-    x=df_market['bucket_time'],
-    open=df_market['open'], high=df_market['high'],
-    low=df_market['low'], close=df_market['close'],
-    name='BTC Actual',
-    increasing_line_color='#26a69a', decreasing_line_color='#ef5350'
-))
-
-# C. AI Forecast
-fig.add_trace(go.Scatter(
-    x=df_forecast['forecast_time'], y=df_forecast['predicted_price'],
-    mode='lines', name='AI Forecast',
-    line=dict(color='#C0C0F0', width=2)
-))
-
-fig.update_layout(
-    template="plotly_dark", height=600,
-    xaxis_rangeslider_visible=False, hovermode="x unified",
-    margin=dict(l=10, r=10, t=10, b=10),
-    legend=dict(orientation="h", y=1.02, x=0, bgcolor="rgba(0,0,0,0)"),
-    xaxis=dict(type='date')
-)
-
-st.plotly_chart(fig, use_container_width=True, key="chart_widget")
-
-# --- TABLES ---
-st.markdown("### 📋 Raw Data Feed")
-c1, c2 = st.columns(2)
-with c1:
-    st.caption("Recent Market Data")
-    st.dataframe(df_market.tail(10)[['bucket_time', 'close', 'volume', 'sentiment_score']].sort_values('bucket_time', ascending=False), use_container_width=True)
-with c2:
-    st.caption("Extended AI Forecast")
-    st.dataframe(df_forecast.tail(10)[['forecast_time', 'predicted_price', 'lower_bound', 'upper_bound']], use_container_width=True)
-
-# Auto-Refresh
-time.sleep(2)
-st.rerun()
\ No newline at end of file
+# --- LIVE VIEW ---
+# Only this fragment re-executes on the refresh tick; the page setup,
+# sidebar and range selector stay untouched between updates.
+@st.fragment(run_every=2)
+def render_live_view(selected_range, symbol):
+    # 2. Data Loading
+    # The big range query only feeds the chart; KPIs and the table come
+    # from a small query over the newest candles
+    df_market, df_forecast = load_data(TIME_RANGES[selected_range], symbol)
+    df_tail = load_tail(symbol)
+
+    if df_tail.empty or df_market.empty:
+        st.warning(f"⏳ Waiting for data pipeline... (View: {selected_range})")
+        return
+
+    # 3. Metrics Calculation
+    latest = df_tail.iloc[0]
+    latest_close = latest['close']
+    latest_open = latest['open']
+    diff = latest_close - latest_open
+    pct = (diff / latest_open) * 100
+    sentiment = latest['sentiment_score']
+
+    # 4. Visual Stitching (Connecting the Lines)
+    # We connect the green line (Actuals) to the yellow line (Forecast)
+    # only if there is a gap between them.
+    # Times are handled as int64 nanoseconds from here on.
+    market_ns = df_market['bucket_time'].values.view('i8')
+    forecast_ns = df_forecast['forecast_time'].values.view('i8')
+    if len(forecast_ns):
+        # Check if the forecast starts AFTER the actuals end
+        # (so prepending the bridge point keeps the frame sorted)
+        if forecast_ns[0] > market_ns[-1]:
+            bridge_time = df_market['bucket_time'].values[-1:]
+            bridge_price = df_market['close'].values[-1:]
+            df_forecast = pd.DataFrame({
+                'forecast_time': np.concatenate([bridge_time, df_forecast['forecast_time'].values]),
+                'predicted_price': np.concatenate([bridge_price, df_forecast['predicted_price'].values]),
+                'lower_bound': np.concatenate([bridge_price, df_forecast['lower_bound'].values]),
+                'upper_bound': np.concatenate([bridge_price, df_forecast['upper_bound'].values])
+            })
+            forecast_ns = df_forecast['forecast_time'].values.view('i8')
+
+    # 5. Render Metrics
+    kpi1, kpi2, kpi3, kpi4 = st.columns(4)
+
+    kpi1.metric(f"{symbol} Price", f"${latest_close:,.2f}", f"{diff:+.2f} ({pct:+.2f}%)")
+
+    sent_label = "Neutral"
+    if sentiment > 0.05: sent_label = "Bullish"
+    elif sentiment < -0.05: sent_label = "Bearish"
+
+    kpi2.metric("Sentiment", f"{sentiment:.4f}", sent_label)
+
+    kpi3.metric("Forecast Model", "Prophet (60m)", "Active 🟢")
+
+    # Anomaly Logic
+    is_anomaly = False
+    if len(forecast_ns):
+        # Check against the prediction for the CURRENT time.
+        # forecast_time is sorted, so binary-search its raw int64 nanoseconds
+        # instead of scanning the whole frame with a boolean mask.
+        now_ns = df_tail['bucket_time'].values.view('i8')[0]
+        idx = np.searchsorted(forecast_ns, now_ns)
+        if idx < len(forecast_ns) and forecast_ns[idx] == now_ns:
+            lower = df_forecast['lower_bound'].values[idx]
+            upper = df_forecast['upper_bound'].values[idx]
+            if latest_close < lower or latest_close > upper:
+                is_anomaly = True
+
+    if is_anomaly:
+        kpi4.error("⚠️ ANOMALY DETECTED")
+    else:
+        kpi4.success("✅ Market Normal")
+
+    # --- CHARTING ---
+    st.subheader("Market Analysis & AI Projection")
+
+    # The figure skeleton is kept in session state and only rebuilt when the
+    # view or renderer changes; otherwise just its trace data is swapped, and
+    # only when the data behind it changed. uirevision keeps pan/zoom.
+    view = f"{symbol}-{selected_range}"
+    webgl = len(df_market) > WEBGL_CANDLE_THRESHOLD
+    signature = (
+        len(market_ns), market_ns[-1],
+        len(forecast_ns), forecast_ns[-1] if len(forecast_ns) else None
+    )
+    chart = st.session_state.get('chart')
+    if chart is None or chart['skeleton'] != (view, webgl):
+        chart = {'skeleton': (view, webgl), 'signature': None, 'fig': new_figure(view, webgl)}
+        st.session_state['chart'] = chart
+    if chart['signature'] != signature:
+        update_figure(chart['fig'], df_market, df_forecast, webgl)
+        chart['signature'] = signature
+
+    st.plotly_chart(chart['fig'], use_container_width=True, key="chart_widget")
+
+    # --- TABLES ---
+    st.markdown("### 📋 Raw Data Feed")
+    c1, c2 = st.columns(2)
+    with c1:
+        st.caption("Recent Market Data")
+        st.dataframe(df_tail[['bucket_time', 'close', 'volume', 'sentiment_score']], use_container_width=True)
+    with c2:
+        st.caption("Extended AI Forecast")
+        st.dataframe(df_forecast.tail(10)[['forecast_time', 'predicted_price', 'lower_bound', 'upper_bound']], use_container_width=True)
+
+
+render_live_view(selected_range, selected_symbol)
@@ -52,6 +52,9 @@ CREATE TABLE IF NOT EXISTS forecast_logs (
 -- Index for faster querying of recent candles (used by Dashboard & ML Engine)
 CREATE INDEX IF NOT EXISTS idx_candles_time ON market_candles (bucket_time DESC);
 
+-- Index for one symbol's recent candles (ML Engine training window, Dashboard per-symbol views)
+CREATE INDEX IF NOT EXISTS idx_mc_sym_bt ON market_candles (symbol, bucket_time DESC);
+
 -- Index for querying forecasts by execution batch
 CREATE INDEX IF NOT EXISTS idx_forecast_exec ON forecast_logs (execution_time DESC);
 
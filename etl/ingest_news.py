@@ -1,10 +1,16 @@
 import feedparser
 import time
+from concurrent.futures import ThreadPoolExecutor
 import datetime
-from bs4 import BeautifulSoup
+from collections import deque, Counter
+from selectolax.lexbor import LexborHTMLParser
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
+from psycopg2.extras import execute_values
 import os
+import logging
+from log_setup import setup_logging
+from functools import lru_cache
 
 # --- CONFIGURATION ---
 # "Dirty" Data Sources (RSS Feeds)
@@ -14,59 +20,123 @@ RSS_FEEDS = [
     "https://cryptopotato.com/feed/"
 ]
 
+# How many article links to remember for deduplication (oldest are forgotten)
+SEEN_LINKS_LIMIT = 20000
+
+# A minute's score waits this long for its candles to appear before being dropped
+SENTIMENT_RETRY_MINUTES = 5
+
 # Defaults to 'localhost' if not running in Docker
 db_host = os.getenv("DB_HOST", "localhost")
 DB_URL = f"postgresql://user:password@{db_host}:5432/alpha_db"
 
+# --- LOGGING ---
+logger = logging.getLogger(__name__)
+
 # --- SETUP ---
 analyzer = SentimentIntensityAnalyzer()
-engine = create_engine(DB_URL)
+# One worker per feed: each poll costs the slowest feed, not the sum of all
+feed_pool = ThreadPoolExecutor(max_workers=len(RSS_FEEDS))
+
+@lru_cache(maxsize=None)
+def get_engine():
+    """
+    Engine behind the single long-lived db_conn, created on first use.
+    Pre-ping and recycling make the reconnect after an error come back healthy.
+    """
+    return create_engine(DB_URL, pool_size=1, pool_pre_ping=True, pool_recycle=1800)
+
+# --- SQL ---
+UPDATE_SENTIMENT_SQL = """
+    UPDATE market_candles AS m
+    SET sentiment_score = v.score
+    FROM (VALUES %s) AS v(bucket_time, score)
+    WHERE m.bucket_time = v.bucket_time
+    RETURNING m.bucket_time
+"""
 
 # --- STATE ---
 seen_links = set()
+seen_order = deque(maxlen=SEEN_LINKS_LIMIT)  # Insertion order, for eviction
 current_minute = None
 sentiment_buffer = []
+pending_scores = {}  # bucket_time -> avg score not yet written to any candle
+db_conn = None       # Long-lived DBAPI connection, reopened after errors
 
 def clean_html(dirty_html):
     """
     Phase 2 Goal: Handle messy text data.
     Strips HTML tags (<p>, <a>, <div>) to get raw text.
+    Uses the C-backed Lexbor parser; we only need the text, not a soup tree.
     """
-    soup = BeautifulSoup(dirty_html, "html.parser")
-    text = soup.get_text(separator=" ")
+    text = LexborHTMLParser(dirty_html).text(separator=" ")
     return text.strip()
 
-def update_db_sentiment(bucket_time, avg_score):
+def score_articles(texts):
     """
-    Updates ALL candles matching this time with the global sentiment score.
+    Scores a batch of article texts with VADER, returning compound scores.
+    The bound method is looked up once for the whole batch.
     """
-    try:
-        time.sleep(2)
-        with engine.connect() as conn:
-            # Removed "AND symbol = 'BTCUSDT'"
-            # This ensures BTC, ETH, SOL, and XRP candles ALL get the score
-            query = text("""
-                UPDATE market_candles 
-                SET sentiment_score = :score
-                WHERE bucket_time = :time 
-            """)
-            result = conn.execute(query, {
-                "score": avg_score,
-                "time": bucket_time
-            })
-            conn.commit()
-            
-            if result.rowcount > 0:
-                print(f"✅ [NEWS] Updated {result.rowcount} candles | Score: {avg_score:.4f}")
-            else:
-                print(f"⚠️ [NEWS] No candles found for {bucket_time}.")
+    polarity_scores = analyzer.polarity_scores
+    return [polarity_scores(text)['compound'] for text in texts]
+
+def remember_link(link):
+    """
+    Marks a link as seen. Memory stays bounded: once SEEN_LINKS_LIMIT links
+    are tracked, the oldest one is forgotten. Feeds only carry recent
+    articles, so old links never come back.
+    """
+    if len(seen_order) == seen_order.maxlen:
+        seen_links.discard(seen_order[0])
+    seen_order.append(link)
+    seen_links.add(link)
 
+def flush_sentiment(now_bucket):
+    """
+    Writes every pending minute score to ALL candles of that minute
+    (BTC, ETH, SOL and XRP alike) in a single UPDATE ... FROM (VALUES ...).
+
+    The stream only saves a candle once the next minute's first trade
+    arrives, so a just-finished minute may have no candles yet. Such
+    minutes stay pending and are retried on the next poll instead of
+    sleeping and hoping, until they are SENTIMENT_RETRY_MINUTES old.
+    """
+    global db_conn
+    if not pending_scores:
+        return
+
+    rows = list(pending_scores.items())
+    try:
+        if db_conn is None:
+            db_conn = get_engine().raw_connection()
+        with db_conn.cursor() as cur:
+            updated = execute_values(cur, UPDATE_SENTIMENT_SQL, rows,
+                                     template="(%s::timestamp, %s::float8)", fetch=True)
+        db_conn.commit()
     except Exception as e:
-        print(f"❌ [NEWS] DB Error: {e}")
+        logger.error("❌ [NEWS] DB Error: %s", e)
+        # Drop the connection so the next flush starts from a fresh one
+        if db_conn is not None:
+            try:
+                db_conn.close()
+            except Exception:
+                pass
+            db_conn = None
+        return
+
+    counts = Counter(row[0] for row in updated)
+    expiry = now_bucket - datetime.timedelta(minutes=SENTIMENT_RETRY_MINUTES)
+    for bucket_time, avg_score in rows:
+        if counts[bucket_time] > 0:
+            logger.info("✅ [NEWS] Updated %d candles | Score: %.4f", counts[bucket_time], avg_score)
+            del pending_scores[bucket_time]
+        elif bucket_time < expiry:
+            logger.warning("⚠️ [NEWS] No candles found for %s.", bucket_time)
+            del pending_scores[bucket_time]
 
 def process_news_stream():
     global current_minute, sentiment_buffer, seen_links
-    print("Polling RSS Feeds for Crypto News...")
+    logger.info("Polling RSS Feeds for Crypto News...")
     
     while True:
         try:
@@ -85,44 +155,70 @@ def process_news_stream():
                 # Calculate Average Sentiment for the minute that just finished
                 if sentiment_buffer:
                     avg_score = sum(sentiment_buffer) / len(sentiment_buffer)
-                    print(f"Minute {current_minute} finished. Avg Sentiment: {avg_score:.4f}")
-                    update_db_sentiment(current_minute, avg_score)
+                    logger.info("Minute %s finished. Avg Sentiment: %.4f", current_minute, avg_score)
+                    pending_scores[current_minute] = avg_score
                 
                 # Reset for the new minute
                 current_minute = minute_bucket
                 sentiment_buffer = []
-                print(f"Starting News Bucket: {current_minute}")
+                logger.info("Starting News Bucket: %s", current_minute)
+
+            # Write finished minutes (and retry ones whose candles were late)
+            flush_sentiment(minute_bucket)
 
             # 3. Poll Feeds (The "Scraping" part)
-            for url in RSS_FEEDS:
-                feed = feedparser.parse(url)
-                
+            # Fetch all feeds concurrently, then process them in order.
+            # Each feed is scored on its own, so a failing feed or article
+            # never costs the articles already collected this cycle.
+            fetches = [feed_pool.submit(feedparser.parse, url) for url in RSS_FEEDS]
+            for url, fetch in zip(RSS_FEEDS, fetches):
+                try:
+                    feed = fetch.result()
+                except Exception as e:
+                    logger.error("Error polling %s: %s", url, e)
+                    continue
+
+                new_links, new_articles = [], []
                 for entry in feed.entries:
-                    # Deduplication Filter (The "Data Science Task")
-                    if entry.link in seen_links:
+                    try:
+                        # Deduplication Filter (The "Data Science Task")
+                        link = entry.link
+                        if link in seen_links or link in new_links:
+                            continue
+
+                        # Dirty Data Cleaning
+                        raw_title = entry.title
+                        raw_summary = getattr(entry, 'summary', '')
+
+                        clean_summary = clean_html(raw_summary)
+                    except Exception as e:
+                        logger.warning("   Skipping malformed article from %s: %s", url, e)
                         continue
-                    
-                    seen_links.add(entry.link)
-                    
-                    # Dirty Data Cleaning
-                    raw_title = entry.title
-                    raw_summary = getattr(entry, 'summary', '')
-                    
-                    clean_summary = clean_html(raw_summary)
-                    full_text = f"{raw_title} {clean_summary}"
-                    
-                    # Sentiment Scoring
-                    score = analyzer.polarity_scores(full_text)['compound']
-                    sentiment_buffer.append(score)
-                    
-                    print(f"   New Article: {raw_title[:50]}... (Score: {score})")
+                    new_links.append(link)
+                    new_articles.append((raw_title, f"{raw_title} {clean_summary}"))
+
+                # 4. Sentiment Scoring (one pass over the feed's new articles)
+                # Links are only marked seen once their score is in the buffer
+                scores = score_articles([full_text for _, full_text in new_articles])
+                sentiment_buffer.extend(scores)
+                for link in new_links:
+                    remember_link(link)
+                for (raw_title, _), score in zip(new_articles, scores):
+                    logger.info("   New Article: %s... (Score: %s)", raw_title[:50], score)
 
             # Wait 30 seconds before polling again to avoid spamming
             time.sleep(30)
 
         except Exception as e:
-            print(f"Error polling feeds: {e}")
+            logger.error("Error polling feeds: %s", e)
             time.sleep(30)
 
 if __name__ == "__main__":
-    process_news_stream()
\ No newline at end of file
+    listener = setup_logging(logger)
+    try:
+        process_news_stream()
+    finally:
+        listener.stop()
+        if db_conn is not None:
+            db_conn.close()
+        get_engine().dispose()
\ No newline at end of file
@@ -1,9 +1,18 @@
 import asyncio
 import websockets
-import json
-from datetime import datetime, timezone
-from sqlalchemy import create_engine, text
+import orjson
+from datetime import datetime, timedelta
+import numpy as np
+from numba import njit
+import asyncpg
 import os
+import logging
+from log_setup import setup_logging
+
+try:
+    import uvloop  # libuv-based event loop; POSIX only
+except ImportError:
+    uvloop = None
 
 
 # --- CONFIGURATION ---
@@ -17,124 +26,351 @@ SYMBOLS = ["btcusdt", "ethusdt", "solusdt", "xrpusdt"]
 STREAMS = "/".join([f"{s}@trade" for s in SYMBOLS])
 BINANCE_URL = f"wss://stream.binance.com:9443/stream?streams={STREAMS}"
 
+# Websocket tuning: permessage-deflate shrinks the many small trade frames,
+# and a deeper incoming queue absorbs bursts while the loop is busy.
+WS_OPTIONS = dict(
+    compression='deflate',
+    max_size=2**20,       # Largest accepted frame (bytes)
+    max_queue=4096,       # Frames buffered by the library before backpressure
+    ping_interval=20, ping_timeout=20, close_timeout=5
+)
+
+# Raw ticks are buffered and written in batches: a flush happens once this
+# many ticks are waiting, or when the oldest has waited TICK_FLUSH_SECONDS.
+TICK_QUEUE_SIZE = 10000
+TICK_BATCH_SIZE = 500
+TICK_FLUSH_SECONDS = 0.2
+
+# Received frames wait here for the consumer; the receive loop never waits on
+# parsing or the database. Queue depths are logged every BACKLOG_LOG_SECONDS.
+FRAME_QUEUE_SIZE = 20000
+# The consumer takes up to this many waiting frames at once and aggregates
+# them as arrays instead of one trade at a time.
+FRAME_BATCH_SIZE = 1000
+
+# Finished candles are written in the background, at most this many at once
+CANDLE_WRITE_CONCURRENCY = 8
+BACKLOG_LOG_SECONDS = 10
+
+# --- LOGGING ---
+logger = logging.getLogger(__name__)
+
 # --- DATABASE CONNECTION ---
-engine = create_engine(DB_URL)
+# asyncpg pool, created once inside the event loop by init_pool().
+# Writes reuse pooled connections and never block the receive loop.
+pool = None
+
+async def init_pool():
+    global pool
+    pool = await asyncpg.create_pool(
+        dsn=DB_URL, min_size=4, max_size=16,
+        statement_cache_size=1024,
+        server_settings={'jit': 'off'}  # Tiny OLTP statements gain nothing from JIT
+    )
+
+# --- SQL ---
+# Raw ticks are streamed in with COPY; the fixed candle statement text lets
+# asyncpg prepare it once per pooled connection and reuse it from the cache.
+RAW_TICK_COLUMNS = ['symbol', 'price', 'quantity', 'trade_time']
+INSERT_CANDLE_SQL = """
+    INSERT INTO market_candles (
+        bucket_time, symbol, open, high, low, close, volume, trade_count
+    ) VALUES (
+        $1, $2, $3, $4, $5, $6, $7, $8
+    ) ON CONFLICT (bucket_time, symbol) DO NOTHING
+"""
 
 # --- GLOBAL STATE (Multi-Symbol Aggregation) ---
-# Key: Symbol (e.g., 'BTCUSDT'), Value: Candle Dict
+# Key: Symbol (e.g., 'BTCUSDT'), Value: Candle
 active_candles = {}
+# Raw websocket frames waiting to be parsed, and (symbol, price, quantity,
+# trade_time) rows waiting for the DB writer.
+# Both are created inside the running event loop by connect_to_stream.
+frame_queue = None
+tick_queue = None
+# Background candle writes: a semaphore capping them (also created by
+# connect_to_stream) and the set of tasks still running.
+candle_write_slots = None
+inflight_saves = set()
+# Long-running background tasks (consumer, DB writer, backlog report)
+workers = []
+
+EPOCH = datetime(1970, 1, 1)
+
+class Candle:
+    """
+    The open one-minute candle of a symbol. Fixed __slots__ make every field
+    a plain attribute slot instead of a dict key lookup.
+    """
+    __slots__ = ('open', 'high', 'low', 'close', 'volume', 'start_minute', 'trade_count')
 
-def get_empty_candle():
-    return {
-        'open': None, 'high': float('-inf'), 'low': float('inf'),
-        'close': None, 'volume': 0.0, 'start_time': None, 'trade_count': 0
-    }
+    def __init__(self, start_minute=None, open_=None, high=float('-inf'), low=float('inf'),
+                 close=None, volume=0.0, trade_count=0):
+        self.start_minute = start_minute
+        self.open = open_
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.trade_count = trade_count
 
-def save_raw_tick(tick_data):
+async def save_raw_ticks(rows):
+    """Bulk-loads a batch of raw ticks with one COPY (binary protocol, no per-row INSERT)."""
     try:
-        with engine.connect() as conn:
-            query = text("""
-                INSERT INTO raw_ticks (symbol, price, quantity, trade_time)
-                VALUES (:symbol, :price, :quantity, :time)
-            """)
-            conn.execute(query, {
-                "symbol": tick_data['s'],
-                "price": float(tick_data['p']),
-                "quantity": float(tick_data['q']),
-                "time": datetime.fromtimestamp(tick_data['T'] / 1000)
-            })
-            conn.commit()
+        async with pool.acquire() as conn:
+            await conn.copy_records_to_table('raw_ticks', records=rows, columns=RAW_TICK_COLUMNS)
     except Exception as e:
-        print(f"⚠️ Error saving raw tick: {e}")
+        logger.error("⚠️ Error saving raw ticks: %s", e)
 
-def save_candle_to_db(symbol, candle_data):
+async def db_writer_task():
+    """
+    Consumer side of tick_queue: collects up to TICK_BATCH_SIZE ticks (or
+    whatever arrived within TICK_FLUSH_SECONDS) and writes them as one batch.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        rows = [await tick_queue.get()]
+        deadline = loop.time() + TICK_FLUSH_SECONDS
+        while len(rows) < TICK_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                rows.append(await asyncio.wait_for(tick_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        await save_raw_ticks(rows)
+
+async def save_candle_to_db(symbol, candle):
+    # The only place a candle's minute becomes a datetime
+    bucket_time = minute_to_time(candle.start_minute)
     try:
-        with engine.connect() as conn:
-            query = text("""
-                INSERT INTO market_candles (
-                    bucket_time, symbol, open, high, low, close, volume, trade_count
-                ) VALUES (
-                    :time, :symbol, :open, :high, :low, :close, :volume, :count
-                ) ON CONFLICT (bucket_time, symbol) DO NOTHING
-            """)
-            conn.execute(query, {
-                "time": candle_data['start_time'],
-                "symbol": symbol,  # <--- NOW DYNAMIC
-                "open": candle_data['open'],
-                "high": candle_data['high'],
-                "low": candle_data['low'],
-                "close": candle_data['close'],
-                "volume": candle_data['volume'],
-                "count": candle_data['trade_count']
-            })
-            conn.commit()
-        print(f"✅ [{symbol}] Candle Saved: {candle_data['start_time']} | Close: ${candle_data['close']}")
+        async with candle_write_slots, pool.acquire() as conn:
+            await conn.execute(INSERT_CANDLE_SQL,
+                bucket_time,
+                symbol,  # <--- NOW DYNAMIC
+                candle.open,
+                candle.high,
+                candle.low,
+                candle.close,
+                candle.volume,
+                candle.trade_count
+            )
+        logger.debug("✅ [%s] Candle Saved: %s | Close: $%s", symbol, bucket_time, candle.close)
     except Exception as e:
-        print(f"❌ Error saving candle: {e}")
+        logger.error("❌ Error saving candle: %s", e)
+
+def schedule_candle_save(symbol, candle):
+    """
+    Writes a finished candle in the background so the next minute starts
+    aggregating right away. save_candle_to_db logs its own errors; the task
+    is referenced until done so it cannot be garbage-collected mid-write.
+    """
+    task = asyncio.create_task(save_candle_to_db(symbol, candle))
+    inflight_saves.add(task)
+    task.add_done_callback(inflight_saves.discard)
+
+def minute_to_time(minute):
+    """Epoch minute -> naive UTC datetime (the candle's bucket_time)."""
+    return EPOCH + timedelta(minutes=minute)
+
+@njit(cache=True)
+def aggregate_runs(prices, qtys, minutes, start):
+    """
+    One fused native pass over a symbol's trades (in arrival order).
+    A trade opens a new candle only when its minute is later than every
+    minute seen so far; late trades fold into the candle that is open.
+    Returns whether the first trade already opened a new candle, plus each
+    run's minute, open, high, low, close, volume and trade count.
+    """
+    n = prices.size
+    run_minutes = np.empty(n, np.int64)
+    opens = np.empty(n)
+    highs = np.empty(n)
+    lows = np.empty(n)
+    closes = np.empty(n)
+    volumes = np.zeros(n)
+    counts = np.zeros(n, np.int64)
 
-async def process_message(msg):
+    k = 0
+    current = start
+    new_first = False
+    run_minutes[0] = start
+    opens[0] = prices[0]
+    highs[0] = -np.inf
+    lows[0] = np.inf
+    for i in range(n):
+        p = prices[i]
+        if minutes[i] > current:
+            if i == 0:
+                new_first = True
+            else:
+                k += 1
+            current = minutes[i]
+            run_minutes[k] = current
+            opens[k] = p
+            highs[k] = p
+            lows[k] = p
+        if p > highs[k]: highs[k] = p
+        if p < lows[k]: lows[k] = p
+        closes[k] = p
+        volumes[k] += qtys[i]
+        counts[k] += 1
+
+    k += 1
+    return (new_first, run_minutes[:k], opens[:k], highs[:k], lows[:k],
+            closes[:k], volumes[:k], counts[:k])
+
+async def process_batch(frames):
     global active_candles
-    
-    # Parse Combined Stream Data
+
+    # 1. Parse all frames into parallel columns
     # Format: {"stream": "btcusdt@trade", "data": {...}}
-    payload = json.loads(msg)
-    data = payload['data']
-    
-    symbol = data['s'] # e.g., "BTCUSDT"
-    price = float(data['p'])
-    qty = float(data['q'])
-    
-    # Force UTC Timezone
-    trade_time = datetime.fromtimestamp(data['T'] / 1000, timezone.utc)
-    trade_minute = trade_time.replace(second=0, microsecond=0, tzinfo=None)
-
-    # Initialize state for this symbol if it doesn't exist yet
-    if symbol not in active_candles:
-        active_candles[symbol] = get_empty_candle()
-
-    current = active_candles[symbol]
-
-    # 1. Logic - Is this a new minute?
-    if current['start_time'] is None:
-        current['start_time'] = trade_minute
-
-    if trade_minute > current['start_time']:
-        # Save completed candle for this specific symbol
-        save_candle_to_db(symbol, current)
-        
-        # Reset for new minute
-        active_candles[symbol] = {
-            'open': price, 'high': price, 'low': price, 'close': price,
-            'volume': qty, 'start_time': trade_minute, 'trade_count': 1
-        }
-        print(f"🔄 [{symbol}] New Minute: {trade_minute}")
-    else:
-        # Update existing candle
-        if current['open'] is None: current['open'] = price
-        current['high'] = max(current['high'], price)
-        current['low'] = min(current['low'], price)
-        current['close'] = price
-        current['volume'] += qty
-        current['trade_count'] += 1
+    symbols, prices, qtys, trade_ms = [], [], [], []
+    for msg in frames:
+        try:
+            data = orjson.loads(msg)['data']
+            symbols.append(data['s']) # e.g., "BTCUSDT"
+            prices.append(float(data['p']))
+            qtys.append(float(data['q']))
+            trade_ms.append(data['T'])
+        except Exception as e:
+            logger.warning("⚠️ Error processing message: %s", e)
+    if not symbols:
+        return
+
+    # 2. Hand the raw ticks to the batched DB writer
+    for symbol, price, qty, ms in zip(symbols, prices, qtys, trade_ms):
+        # Epoch milliseconds -> naive UTC datetime, without a tz lookup
+        trade_time = EPOCH + timedelta(milliseconds=ms)
+        await tick_queue.put((symbol, price, qty, trade_time))
+
+    prices = np.array(prices)
+    qtys = np.array(qtys)
+    minutes = np.array(trade_ms, dtype=np.int64) // 60000
+
+    # 3. Aggregate each symbol's trades (kept in arrival order)
+    names, group = np.unique(symbols, return_inverse=True)
+    for k, symbol in enumerate(names.tolist()):
+        idx = np.flatnonzero(group == k)
+        p, q, m = prices[idx], qtys[idx], minutes[idx]
+
+        # Initialize state for this symbol if it doesn't exist yet
+        if symbol not in active_candles:
+            active_candles[symbol] = Candle()
+        current = active_candles[symbol]
+        if current.start_minute is None:
+            current.start_minute = int(m[0])
+        start = current.start_minute
+
+        new_first, run_minutes, opens, highs, lows, closes, volumes, counts = (
+            aggregate_runs(p, q, m, start)
+        )
+        opens, highs, lows = opens.tolist(), highs.tolist(), lows.tolist()
+        closes, volumes, counts = closes.tolist(), volumes.tolist(), counts.tolist()
+
+        for j, trade_minute in enumerate(run_minutes.tolist()):
+            if j == 0 and not new_first:
+                # Update existing candle
+                if current.open is None: current.open = opens[0]
+                if highs[0] > current.high: current.high = highs[0]
+                if lows[0] < current.low: current.low = lows[0]
+                current.close = closes[0]
+                current.volume += volumes[0]
+                current.trade_count += counts[0]
+                continue
+
+            # Save completed candle for this specific symbol
+            schedule_candle_save(symbol, current)
+
+            # Reset for new minute
+            current = active_candles[symbol] = Candle(
+                trade_minute, opens[j], highs[j], lows[j], closes[j], volumes[j], counts[j]
+            )
+            logger.debug("🔄 [%s] New Minute: %s", symbol, minute_to_time(trade_minute))
+
+async def frame_consumer():
+    """
+    Consumer side of frame_queue: takes every waiting frame (up to
+    FRAME_BATCH_SIZE) and aggregates them in one pass.
+    Runs apart from the receive loop, so a slow candle write delays
+    aggregation but never stalls websocket.recv().
+    """
+    while True:
+        frames = [await frame_queue.get()]
+        while len(frames) < FRAME_BATCH_SIZE:
+            try:
+                frames.append(frame_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        try:
+            await process_batch(frames)
+        except Exception as e:
+            logger.error("⚠️ Error processing batch: %s", e)
+
+async def report_backlog():
+    """Logs queue depths so backpressure (a slow consumer or DB) is visible."""
+    while True:
+        await asyncio.sleep(BACKLOG_LOG_SECONDS)
+        logger.info("📊 Backlog: %d frames | %d ticks | %d candle writes",
+                    frame_queue.qsize(), tick_queue.qsize(), len(inflight_saves))
+
+def watch_worker(task):
+    """
+    Done-callback for the background workers. They loop forever, so any
+    exit is a fault; log it rather than let ingest silently back up.
+    """
+    if task.cancelled():
+        return
+    exc = task.exception()
+    logger.error("❌ Worker %s stopped: %r", task.get_name(), exc, exc_info=exc)
 
 async def connect_to_stream():
-    print(f"Connecting to multi-stream: {BINANCE_URL}...")
+    global frame_queue, tick_queue, candle_write_slots
+    while pool is None:
+        try:
+            await init_pool()
+        except Exception as e:
+            logger.error("❌ Database unavailable: %s. Retrying in 5s...", e)
+            await asyncio.sleep(5)
+
+    # Compile the aggregation kernel (or load it from cache) before trading starts
+    aggregate_runs(np.zeros(1), np.zeros(1), np.zeros(1, np.int64), 0)
+
+    frame_queue = asyncio.Queue(maxsize=FRAME_QUEUE_SIZE)
+    tick_queue = asyncio.Queue(maxsize=TICK_QUEUE_SIZE)
+    candle_write_slots = asyncio.Semaphore(CANDLE_WRITE_CONCURRENCY)
+    # Background workers run for the life of the process
+    workers[:] = [
+        asyncio.create_task(frame_consumer(), name="frame_consumer"),
+        asyncio.create_task(db_writer_task(), name="db_writer"),
+        asyncio.create_task(report_backlog(), name="report_backlog"),
+    ]
+    for task in workers:
+        task.add_done_callback(watch_worker)
+
+    logger.info("Connecting to multi-stream: %s...", BINANCE_URL)
     while True:
         try:
-            async with websockets.connect(BINANCE_URL) as websocket:
-                print("✅ Connected to Binance Multi-Stream!")
-                while True:
-                    message = await websocket.recv()
-                    # Note: save_raw_tick logic is now best handled inside process_message 
-                    # because we need to parse the 'data' wrapper first.
-                    # So we just call process_message.
-                    await process_message(message)
+            async with websockets.connect(BINANCE_URL, **WS_OPTIONS) as websocket:
+                logger.info("✅ Connected to Binance Multi-Stream!")
+                async for message in websocket:
+                    # Parsing, aggregation and all DB writes happen in the
+                    # background workers; here we only hand the frame over.
+                    await frame_queue.put(message)
+                # async for ends quietly when Binance closes the stream cleanly
+                logger.info("🔌 Stream closed by server. Reconnecting...")
         except (websockets.ConnectionClosed, Exception) as e:
-            print(f"❌ Connection lost: {e}. Retrying in 5s...")
+            logger.error("❌ Connection lost: %s. Retrying in 5s...", e)
             await asyncio.sleep(5)
 
 if __name__ == "__main__":
+    listener = setup_logging(logger)
     try:
-        asyncio.run(connect_to_stream())
+        # Fall back to the stock asyncio loop where uvloop is unavailable
+        run = uvloop.run if uvloop is not None else asyncio.run
+        run(connect_to_stream())
     except KeyboardInterrupt:
-        print("Stopping Stream...")
\ No newline at end of file
+        logger.info("Stopping Stream...")
+    finally:
+        listener.stop()
\ No newline at end of file
@@ -0,0 +1,25 @@
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+
+def setup_logging(logger):
+    """
+    Sends log records through a queue to a background thread that does the
+    actual stdout writes, so the calling loop never blocks on a flush.
+    LOG_LEVEL sets the level of the script's own 'logger' (e.g. DEBUG shows
+    the stream's per-candle messages) without turning on library debug output.
+    Returns the listener; stop it on shutdown to flush what is left.
+    """
+    log_queue = queue.Queue(-1)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    listener = QueueListener(log_queue, handler)
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+    listener.start()
+    return listener
@@ -1,9 +1,16 @@
 import time
+import csv
+import io
+from functools import lru_cache
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 from sqlalchemy import create_engine, text
 from prophet import Prophet
 import logging
 import os
+from log_setup import setup_logging
 
 # List of symbols to forecast
 SYMBOLS = ["BTCUSDT", "ETHUSDT", "SOLUSDT", "XRPUSDT"]
@@ -16,102 +23,232 @@ DB_URL = f"postgresql://user:password@{db_host}:5432/alpha_db"
 
 TRAINING_WINDOW_MINUTES = 60  # Look back 60 minutes
 FORECAST_HORIZON = 5         # Predict next 5 minutes
+WARM_START_ITER = 100        # Optimizer iteration cap when seeded from last cycle
 
-engine = create_engine(DB_URL)
+# symbol -> Stan parameters of the last fit, used to seed the next one
+WARM_START = {}
+
+@lru_cache(maxsize=None)
+def get_engine():
+    """
+    One engine per process (the parent and each spawned worker), created
+    on first use and reused by every forecast cycle. Each process only
+    ever runs one query at a time, so a single pooled connection is enough.
+    """
+    return create_engine(
+        DB_URL, pool_size=1, max_overflow=0, pool_pre_ping=True,
+        pool_recycle=1800, future=True
+    )
 
 # Suppress Prophet's noisy logs
 logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
 logging.getLogger('prophet').setLevel(logging.WARNING)
 
-def fetch_training_data(symbol):
-    """Fetches data for a SPECIFIC symbol."""
-    query = text(f"""
+# --- LOGGING ---
+logger = logging.getLogger(__name__)
+
+# --- SQL ---
+# Built once at import, not on every call
+FETCH_TRAINING_SQL = text("""
+    WITH window_candles AS (
         SELECT bucket_time, close, sentiment_score
         FROM market_candles
-        WHERE bucket_time >= NOW() - INTERVAL '{TRAINING_WINDOW_MINUTES} minutes'
+        WHERE bucket_time >= NOW() - make_interval(mins => :mins)
         AND symbol = :symbol
-        ORDER BY bucket_time ASC
-    """)
-    with engine.connect() as conn:
-        df = pd.read_sql(query, conn, params={"symbol": symbol})
+    )
+    SELECT
+        minutes.bucket_time,
+        prev.close,
+        COALESCE(prev.sentiment_score, 0.0) AS sentiment_score,
+        (SELECT COUNT(*) FROM window_candles) AS n_candles
+    FROM generate_series(
+        (SELECT MIN(bucket_time) FROM window_candles),
+        (SELECT MAX(bucket_time) FROM window_candles),
+        INTERVAL '1 minute'
+    ) AS minutes(bucket_time)
+    CROSS JOIN LATERAL (
+        SELECT close, sentiment_score
+        FROM window_candles
+        WHERE window_candles.bucket_time <= minutes.bucket_time
+        ORDER BY window_candles.bucket_time DESC
+        LIMIT 1
+    ) AS prev
+    ORDER BY minutes.bucket_time ASC
+""")
+
+COPY_FORECASTS_SQL = """
+    COPY forecast_logs (forecast_time, predicted_price, lower_bound, upper_bound, symbol)
+    FROM STDIN WITH (FORMAT csv)
+"""
+
+def fetch_training_data(symbol):
+    """
+    Fetches data for a SPECIFIC symbol, already gap-filled by Postgres:
+    one row per minute between the first and last candle of the window,
+    with missing minutes carrying the previous candle forward.
+    'n_candles' is the number of real (non-filled) candles in the window.
+    """
+    with get_engine().connect() as conn:
+        df = pd.read_sql(FETCH_TRAINING_SQL, conn, params={
+            "mins": TRAINING_WINDOW_MINUTES, "symbol": symbol
+        })
     return df
 
 def prepare_data(df):
     """
     The "Data Science Task": Handle Missing Data (Gaps).
+    The resample + forward-fill now happens in SQL (see fetch_training_data),
+    so all that is left is shaping the frame for Prophet.
     """
     if df.empty:
         return df
 
-    # 1. Renaming for Prophet (ds = time, y = target)
+    # Renaming for Prophet (ds = time, y = target)
     df = df.rename(columns={'bucket_time': 'ds', 'close': 'y'})
+    return df.drop(columns='n_candles')
+
+def stan_init(model):
+    """Fitted parameters of a Prophet model, in the shape fit(init=...) takes."""
+    res = {}
+    for pname in ['k', 'm', 'sigma_obs']:
+        res[pname] = model.params[pname][0][0]
+    for pname in ['delta', 'beta']:
+        res[pname] = model.params[pname][0]
+    return res
+
+def new_model():
+    """An unfitted Prophet model with the sentiment regressor."""
+    model = Prophet(interval_width=0.95)
+    model.add_regressor('sentiment_score')
+    return model
+
+def forecast_one(symbol, init=None):
+    """
+    Fetches, fits and predicts ONE symbol. Runs in a worker process since the
+    Prophet/Stan fit is CPU-bound; returns (symbol, future forecast rows,
+    fitted params), with None instead of rows when there is not enough data yet.
+    'init' (last cycle's params) seeds the optimizer, so a minute-on-minute
+    refit converges in a few iterations instead of starting cold.
+    """
+    raw_df = fetch_training_data(symbol)
+    if raw_df.empty or raw_df['n_candles'].iloc[0] < 20:
+        return symbol, None, None
+
+    df = prepare_data(raw_df)
     
-    # 2. Ensure 'ds' is datetime
-    # Ensure we drop timezone info to match the DB format
-    df['ds'] = pd.to_datetime(df['ds']).dt.tz_localize(None)
-    
-    # 3. FIX GAPS (The Resume Bullet Point)
-    # We set the time as index, resample to 1 minute, and Forward Fill
-    df = df.set_index('ds').resample('1min').ffill().reset_index()
+    model = new_model()
+    if init is None:
+        model.fit(df)
+    else:
+        try:
+            # Prophet falls back to its default for any param whose shape changed
+            model.fit(df, init=init, algorithm='Newton', iter=WARM_START_ITER)
+        except RuntimeError as e:
+            # Already Newton, so Prophet has no optimizer fallback left; start cold
+            logger.warning("⚠️ [%s] Warm-start fit failed (%s), refitting cold.", symbol, e)
+            model = new_model()
+            model.fit(df)
     
-    # 4. Handle Sentiment (Fill NaNs with 0 if sentiment didn't arrive)
-    df['sentiment_score'] = df['sentiment_score'].fillna(0.0)
+    future = model.make_future_dataframe(periods=FORECAST_HORIZON, freq='min')
+    future['sentiment_score'] = df['sentiment_score'].iloc[-1]
+    forecast = model.predict(future)
     
-    return df
+    # Filter for future only
+    last_actual_time = df['ds'].iloc[-1]
+    future_forecast = forecast[forecast['ds'] > last_actual_time]
+    return symbol, future_forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']], stan_init(model)
 
-def generate_forecast():
-    print("🧠 Starting Forecast Cycle...")
+def generate_forecast(pool):
+    logger.info("🧠 Starting Forecast Cycle...")
     
-    for symbol in SYMBOLS:
-        print(f"   > Processing {symbol}...", end=" ")
-        
-        raw_df = fetch_training_data(symbol)
-        if len(raw_df) < 20:
-            print("Not enough data yet.")
+    # All symbols are fitted in parallel; one symbol failing only skips that symbol
+    futures = {
+        symbol: pool.submit(forecast_one, symbol, WARM_START.get(symbol))
+        for symbol in SYMBOLS
+    }
+    ready = []
+    broken = None
+    for symbol, future in futures.items():
+        try:
+            _, future_forecast, params = future.result()
+        except BrokenProcessPool as e:
+            # A worker died: symbols still running are lost, finished ones are kept
+            broken = e
+            WARM_START.pop(symbol, None)
+            logger.error("   > Processing %s... Lost with its worker.", symbol)
+            continue
+        except Exception as e:
+            # Never reuse the params of a symbol that failed: start it cold next cycle
+            WARM_START.pop(symbol, None)
+            logger.error("   > Processing %s... Failed: %s", symbol, e)
+            continue
+
+        if future_forecast is None:
+            logger.info("   > Processing %s... Not enough data yet.", symbol)
             continue # Skip to next symbol
 
-        df = prepare_data(raw_df)
-        
-        # ... (The rest of the Prophet logic stays the same) ...
-        model = Prophet(interval_width=0.95)
-        model.add_regressor('sentiment_score')
-        model.fit(df)
-        
-        future = model.make_future_dataframe(periods=FORECAST_HORIZON, freq='min')
-        future['sentiment_score'] = df['sentiment_score'].iloc[-1]
-        forecast = model.predict(future)
-        
-        # Filter for future only
-        last_actual_time = df['ds'].iloc[-1]
-        future_forecast = forecast[forecast['ds'] > last_actual_time]
+        WARM_START[symbol] = params
         
         if not future_forecast.empty:
-            save_forecast(symbol, future_forecast) # <--- Pass symbol here
-            print(f"Saved!")
-
-def save_forecast(symbol, forecast_df):
-    with engine.connect() as conn:
-        for _, row in forecast_df.iterrows():
-            query = text("""
-                INSERT INTO forecast_logs (forecast_time, predicted_price, lower_bound, upper_bound, symbol)
-                VALUES (:time, :price, :low, :high, :symbol)
-            """)
-            conn.execute(query, {
-                "time": row['ds'],
-                "price": row['yhat'],
-                "low": row['yhat_lower'],
-                "high": row['yhat_upper'],
-                "symbol": symbol # <--- Save the symbol
-            })
-            conn.commit()
+            ready.append((symbol, future_forecast))
+            logger.info("   > Processing %s... Done.", symbol)
+
+    if ready:
+        save_forecasts(ready)
+        logger.info("   Saved forecasts for %d symbols!", len(ready))
+
+    if broken is not None:
+        raise broken # The main loop replaces the pool
+
+def save_forecasts(forecasts):
+    """
+    Writes the rows of every (symbol, forecast_df) pair of a cycle with one
+    COPY in a single transaction, so the cycle costs one commit.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for symbol, forecast_df in forecasts:
+        writer.writerows(zip(
+            forecast_df['ds'], forecast_df['yhat'],
+            forecast_df['yhat_lower'], forecast_df['yhat_upper'],
+            [symbol] * len(forecast_df) # <--- Save the symbol
+        ))
+    buffer.seek(0)
+    with get_engine().begin() as conn:
+        with conn.connection.cursor() as cur:
+            cur.copy_expert(COPY_FORECASTS_SQL, buffer)
+
+def make_pool():
+    """
+    One long-lived worker per symbol. Workers are spawned rather than forked,
+    so each imports this module once and gets its own DB engine instead of
+    inheriting the parent's pooled connections.
+    """
+    return ProcessPoolExecutor(
+        max_workers=len(SYMBOLS),
+        mp_context=multiprocessing.get_context("spawn")
+    )
 
 if __name__ == "__main__":
-    print(" Forecast Engine Started...")
-    while True:
-        try:
-            generate_forecast()
-            # Run every minute
-            time.sleep(60)
-        except Exception as e:
-            print(f" Model Error: {e}")
-            time.sleep(60)
\ No newline at end of file
+    listener = setup_logging(logger)
+    logger.info(" Forecast Engine Started...")
+    pool = make_pool()
+    try:
+        while True:
+            try:
+                generate_forecast(pool)
+                # Run every minute
+                time.sleep(60)
+            except BrokenProcessPool as e:
+                # A dead worker (OOM, cmdstan crash) breaks the pool for good
+                logger.error(" Worker pool broken: %s. Starting a new one.", e)
+                pool.shutdown(wait=False)
+                pool = make_pool()
+                time.sleep(60)
+            except Exception as e:
+                logger.error(" Model Error: %s", e)
+                time.sleep(60)
+    finally:
+        pool.shutdown()
+        get_engine().dispose()
+        listener.stop()
\ No newline at end of file
@@ -8,21 +8,24 @@ DB_URL = f"postgresql://user:password@{db_host}:5432/alpha_db"
 
 def reset_database():
     print(f"🔌 Connecting to database at {DB_URL}...")
+    # One-shot script: a plain engine, disposed as soon as the reset is done
+    engine = create_engine(DB_URL)
     try:
-        engine = create_engine(DB_URL)
         with engine.connect() as conn:
             print("🗑️  Wiping all data...")
             
-            # Wipes all data and resets the ID counters to 1
-            conn.execute(text("TRUNCATE TABLE raw_ticks RESTART IDENTITY;"))
-            conn.execute(text("TRUNCATE TABLE market_candles RESTART IDENTITY;"))
-            conn.execute(text("TRUNCATE TABLE forecast_logs RESTART IDENTITY;"))
+            # A throwaway reset does not need to wait for the WAL flush
+            conn.execute(text("SET LOCAL synchronous_commit = OFF;"))
+            # Wipes all data and resets the ID counters to 1 (one lock, one statement)
+            conn.execute(text("TRUNCATE TABLE raw_ticks, market_candles, forecast_logs RESTART IDENTITY CASCADE;"))
             
             conn.commit()
             print("✅ Database successfully wiped and reset!")
             
     except Exception as e:
         print(f"❌ Error: {e}")
+    finally:
+        engine.dispose()
 
 if __name__ == "__main__":
     # Confirmation safety check
@@ -22,6 +22,8 @@ CREATE TABLE IF NOT EXISTS market_candles (
     PRIMARY KEY (bucket_time, symbol)
 );
 
+CREATE INDEX IF NOT EXISTS idx_mc_sym_bt ON market_candles (symbol, bucket_time DESC);
+
 -- 3. FORECAST LOGS TABLE
 CREATE TABLE IF NOT EXISTS forecast_logs (
     id SERIAL PRIMARY KEY,